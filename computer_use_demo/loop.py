@@ -2,13 +2,20 @@
 Agentic sampling loop that calls the Anthropic API and local implenmentation of anthropic-defined computer use tools.
 """
 
+import inspect
 import platform
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
+from types import SimpleNamespace
 from typing import Any, cast
 
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
+from anthropic import (
+    APIResponse,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
+)
 from anthropic.types import (
     ToolResultBlockParam,
 )
@@ -26,6 +33,10 @@ from .tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
 
 BETA_FLAG = "computer-use-2025-11-24"
 
+# Passed to stream_callback just before each API request is sent, ahead of any
+# real stream event, so callers can tell a request in flight from tools running
+REQUEST_START_EVENT = SimpleNamespace(type="request_start")
+
 
 class APIProvider(StrEnum):
     ANTHROPIC = "anthropic"
@@ -74,54 +85,95 @@ async def sampling_loop(
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
     max_turns: int = 15,
+    client: AsyncAnthropic | AsyncAnthropicBedrock | AsyncAnthropicVertex | None = None,
+    stream_callback: Callable[[Any], None] | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    Pass a long-lived `client` to reuse its connection pool across calls;
+    otherwise one is created for this call from `provider` and `api_key`.
+
+    With `stream_callback`, each response is streamed and the callback gets every
+    stream event as it arrives, preceded by `REQUEST_START_EVENT` when the request
+    is sent. `api_response_callback` is not called in that mode, as there is no
+    raw response to hand over.
     """
     tool_collection = ToolCollection(
         ComputerTool(),
         BashTool(),
         EditTool(),
     )
-    system = (
-        f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
-    )
+    enable_prompt_caching = provider == APIProvider.ANTHROPIC
+    system: list[BetaTextBlockParam] = [
+        {
+            "type": "text",
+            "text": f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
+        }
+    ]
+    if enable_prompt_caching:
+        # The system prompt is identical on every turn, so cache it
+        system[0]["cache_control"] = {"type": "ephemeral"}
 
     total_input_tokens = 0
     total_output_tokens = 0
+    total_cache_creation_tokens = 0
+    total_cache_read_tokens = 0
+
+    if client is None:
+        if provider == APIProvider.ANTHROPIC:
+            client = AsyncAnthropic(api_key=api_key)
+        elif provider == APIProvider.VERTEX:
+            client = AsyncAnthropicVertex()
+        elif provider == APIProvider.BEDROCK:
+            client = AsyncAnthropicBedrock()
 
     turns = 0
     while turns < max_turns:
+        if enable_prompt_caching:
+            _inject_prompt_caching(messages)
         if only_n_most_recent_images:
             _maybe_filter_to_n_most_recent_images(messages, only_n_most_recent_images)
 
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key)
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        raw_response = client.beta.messages.with_raw_response.create(
-            max_tokens=max_tokens,
-            messages=messages,
-            model=model,
-            system=system,
-            tools=tool_collection.to_params(),
-            betas=[BETA_FLAG],
-        )
+        if stream_callback is not None:
+            stream_callback(REQUEST_START_EVENT)
+            async with client.beta.messages.stream(
+                max_tokens=max_tokens,
+                messages=messages,
+                model=model,
+                system=system,
+                tools=tool_collection.to_params(),
+                betas=[BETA_FLAG],
+            ) as stream:
+                async for event in stream:
+                    stream_callback(event)
+                response = await stream.get_final_message()
+        else:
+            # Call the API
+            # we use raw_response to provide debug information to streamlit. Your
+            # implementation may be able call the SDK directly with:
+            # `response = client.messages.create(...)` instead.
+            raw_response = await client.beta.messages.with_raw_response.create(
+                max_tokens=max_tokens,
+                messages=messages,
+                model=model,
+                system=system,
+                tools=tool_collection.to_params(),
+                betas=[BETA_FLAG],
+            )
 
-        api_response_callback(cast(APIResponse[BetaMessage], raw_response))
+            api_response_callback(cast(APIResponse[BetaMessage], raw_response))
 
-        response = raw_response.parse()
+            response = raw_response.parse()
+            # Older SDKs parse raw responses synchronously; newer ones return a coroutine
+            if inspect.isawaitable(response):
+                response = await response
 
         if hasattr(response, 'usage') and response.usage:
             total_input_tokens += response.usage.input_tokens
             total_output_tokens += response.usage.output_tokens
+            total_cache_creation_tokens += getattr(response.usage, "cache_creation_input_tokens", 0) or 0
+            total_cache_read_tokens += getattr(response.usage, "cache_read_input_tokens", 0) or 0
 
         messages.append(
             {
@@ -144,12 +196,35 @@ async def sampling_loop(
                 tool_output_callback(result, content_block.id)
 
         if not tool_result_content:
-            return messages, {"input_tokens": total_input_tokens, "output_tokens": total_output_tokens, "model": model}
+            break
 
         messages.append({"content": tool_result_content, "role": "user"})
         turns += 1
 
-    return messages, {"input_tokens": total_input_tokens, "output_tokens": total_output_tokens, "model": model}
+    return messages, {
+        "input_tokens": total_input_tokens,
+        "output_tokens": total_output_tokens,
+        "cache_creation_input_tokens": total_cache_creation_tokens,
+        "cache_read_input_tokens": total_cache_read_tokens,
+        "model": model,
+    }
+
+
+def _inject_prompt_caching(messages: list[BetaMessageParam]):
+    """
+    Set cache breakpoints for the 3 most recent turns. One cache breakpoint is left
+    for the system prompt, which is also cached. Step prompts (plain string content)
+    are left as is; the tool result turns around them carry the breakpoints.
+    """
+    breakpoints_remaining = 3
+    for message in reversed(messages):
+        if message["role"] == "user" and isinstance(content := message["content"], list) and content:
+            if breakpoints_remaining:
+                breakpoints_remaining -= 1
+                content[-1]["cache_control"] = {"type": "ephemeral"}  # type: ignore
+            else:
+                # Older turns may still carry a breakpoint from an earlier call
+                content[-1].pop("cache_control", None)  # type: ignore
 
 
 def _maybe_filter_to_n_most_recent_images(
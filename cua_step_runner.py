@@ -14,7 +14,6 @@ Usage:
 import asyncio
 import argparse
 import base64
-import json
 import os
 import sys
 import time
@@ -28,16 +27,23 @@ load_dotenv(Path(__file__).parent / ".env")
 
 from computer_use_demo.loop import sampling_loop, APIProvider
 from computer_use_demo.tools import ToolResult
+from json_io import read_json, write_json
+from debug_results import DebugResultsCollector
 from anthropic.types.beta import BetaMessage, BetaMessageParam
 from anthropic import APIResponse
 
 
+
+def _write_png(path: Path, base64_image: str):
+    """Decode a base64 screenshot and write it to disk. Runs in a worker thread."""
+    path.write_bytes(base64.b64decode(base64_image))
+
+
 def load_context(context_file: str) -> list:
     """Load conversation messages from a context file."""
     if not os.path.exists(context_file):
         return []
-    with open(context_file, "r") as f:
-        return json.load(f)
+    return read_json(context_file)
 
 
 def save_context(context_file: str, messages: list):
@@ -46,10 +52,7 @@ def save_context(context_file: str, messages: list):
     Strips base64 image data from older messages to keep the file manageable.
     The sampling_loop's only_n_most_recent_images handles the API-side trimming.
     """
-    # Deep copy to avoid mutating the live messages
-    serializable = json.loads(json.dumps(messages, default=str))
-    with open(context_file, "w") as f:
-        json.dump(serializable, f)
+    write_json(context_file, messages, default=str)
 
 
 async def run_step(
@@ -81,23 +84,26 @@ async def run_step(
     # Append the user prompt to conversation
     messages.append({"role": "user", "content": prompt})
 
-    collected_output = []
+    # DEBUG_RESULTS are split off from the rest of the output as it arrives
+    collector = DebugResultsCollector()
     screenshot_paths = []
     screenshot_counter = [0]
     step_id = f"step_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    loop = asyncio.get_running_loop()
+    pending_writes = []
 
     def output_callback(content_block):
         if hasattr(content_block, "type") and content_block.type == "text":
-            collected_output.append(content_block.text)
+            collector.add(content_block.text)
         elif isinstance(content_block, dict) and content_block.get("type") == "text":
-            collected_output.append(content_block.get("text", ""))
+            collector.add(content_block.get("text", ""))
 
     def tool_output_callback(result: ToolResult, tool_use_id: str):
         if result.base64_image:
             screenshot_counter[0] += 1
             path = screenshots_dir / f"{step_id}_{screenshot_counter[0]}.png"
-            with open(path, "wb") as f:
-                f.write(base64.b64decode(result.base64_image))
+            # Decoding and writing a screenshot would otherwise stall the event loop
+            pending_writes.append(loop.run_in_executor(None, _write_png, path, result.base64_image))
             screenshot_paths.append(str(path))
 
     def api_response_callback(response: APIResponse[BetaMessage]):
@@ -131,15 +137,10 @@ async def run_step(
                 max_tokens=4096,
             )
 
+        await asyncio.gather(*pending_writes)
         duration = time.monotonic() - step_start
-        full_output = " ".join(collected_output)
-
-        # Extract DEBUG_RESULTS from CUA output
-        if "DEBUG_RESULTS:" in full_output:
-            dr_start = full_output.find("DEBUG_RESULTS:") + len("DEBUG_RESULTS:")
-            debug_results = full_output[dr_start:].strip()
-        else:
-            debug_results = full_output[:500] if full_output else ""
+        full_output = collector.full_output
+        debug_results = collector.debug_results
 
         return {
             "status": "done",
@@ -148,12 +149,16 @@ async def run_step(
             "screenshot_paths": screenshot_paths,
             "input_tokens": token_usage["input_tokens"],
             "output_tokens": token_usage["output_tokens"],
+            # Prompt-cache traffic, billed separately and not included in input_tokens
+            "cache_creation_input_tokens": token_usage.get("cache_creation_input_tokens", 0),
+            "cache_read_input_tokens": token_usage.get("cache_read_input_tokens", 0),
             "model": token_usage["model"],
             "duration_seconds": round(duration, 1),
             "error_message": None,
         }
 
     except Exception as e:
+        await asyncio.gather(*pending_writes, return_exceptions=True)
         duration = time.monotonic() - step_start
         return {
             "status": "error",
@@ -162,6 +167,8 @@ async def run_step(
             "screenshot_paths": screenshot_paths,
             "input_tokens": 0,
             "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
             "model": model,
             "duration_seconds": round(duration, 1),
             "error_message": str(e),
@@ -207,12 +214,12 @@ async def main():
     # Write result JSON
     output_path = Path(args.output)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w") as f:
-        json.dump(result, f, indent=2)
+    write_json(output_path, result, indent=True, default=str)
 
     # Print summary to stderr (stdout stays clean for piping)
     print(f"Step {result['status']}: {result['duration_seconds']}s, "
-          f"{result.get('input_tokens', 0):,} in / {result.get('output_tokens', 0):,} out",
+          f"{result.get('input_tokens', 0):,} in / {result.get('output_tokens', 0):,} out, "
+          f"{result.get('cache_creation_input_tokens', 0):,} cache write / {result.get('cache_read_input_tokens', 0):,} cache read",
           file=sys.stderr)
     if result["error_message"]:
         print(f"Error: {result['error_message']}", file=sys.stderr)
@@ -0,0 +1,56 @@
+"""
+DEBUG_RESULTS extraction shared by test_runner and cua_step_runner.
+
+CUA is told to finish a step with "DEBUG_RESULTS:" followed by the text it
+copied from the page's DEBUG OUTPUT section.
+"""
+
+import io
+import re
+
+# Marker Claude is asked to prefix the copied DEBUG OUTPUT text with. Matched
+# case-insensitively, tolerating "Debug Results:" and markdown bold ("**DEBUG_RESULTS:**").
+DEBUG_RESULTS_RE = re.compile(r"DEBUG[_ ]RESULTS:\**\s*", re.IGNORECASE)
+
+
+class DebugResultsCollector:
+    """Collects CUA text blocks and splits off the DEBUG_RESULTS as they arrive.
+
+    Blocks are joined with a space. Everything up to and including the first
+    marker goes to one buffer, everything after it to another, so the output
+    is never rescanned; since a marker can't straddle two blocks, each block
+    is searched once.
+    """
+
+    def __init__(self):
+        self._pre = io.StringIO()
+        self._post = io.StringIO()
+        self.found = False
+
+    def add(self, text: str) -> bool:
+        """Append a text block; returns True if it carried the marker."""
+        buf = self._post if self.found else self._pre
+        if self._pre.tell() or self._post.tell():
+            buf.write(" ")
+        if self.found:
+            buf.write(text)
+            return False
+        match = DEBUG_RESULTS_RE.search(text)
+        if not match:
+            buf.write(text)
+            return False
+        self._pre.write(text[:match.end()])
+        self._post.write(text[match.end():])
+        self.found = True
+        return True
+
+    @property
+    def full_output(self) -> str:
+        return self._pre.getvalue() + self._post.getvalue()
+
+    @property
+    def debug_results(self) -> str:
+        """Text after the marker, or the start of the output if there was none."""
+        if self.found:
+            return self._post.getvalue().strip()
+        return self._pre.getvalue()[:500]
@@ -0,0 +1,38 @@
+"""
+JSON helpers shared by the runners.
+
+Uses orjson when it is installed and falls back to the stdlib json module.
+Either way JSON is handled as bytes.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib json module
+    orjson = None
+
+
+def dumps(obj, indent: bool = False, default=None) -> bytes:
+    """Serialize obj to JSON bytes; default converts values JSON can't represent."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, default=default, indent=2 if indent else None).encode()
+
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def write_json(path, obj, indent: bool = False, default=None):
+    """Write obj to path as JSON."""
+    data = dumps(obj, indent=indent, default=default)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read_json(path):
+    """Read and parse a JSON file."""
+    with open(path, "rb") as f:
+        return loads(f.read())
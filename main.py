@@ -105,7 +105,8 @@ async def main():
         )
 
     from test_runner import calculate_cost
-    cost = calculate_cost(token_usage["input_tokens"], token_usage["output_tokens"], token_usage["model"])
+    cost = calculate_cost(token_usage["input_tokens"], token_usage["output_tokens"], token_usage["model"],
+                          token_usage.get("cache_creation_input_tokens", 0), token_usage.get("cache_read_input_tokens", 0))
     print(f"\nToken usage: {token_usage['input_tokens']:,} in / {token_usage['output_tokens']:,} out (${cost:.4f})")
 
 
@@ -3,6 +3,7 @@ Google Sheets integration for CUA QA.
 Loads test scripts from Google Sheets and writes results back.
 """
 
+import functools
 import os
 from datetime import datetime
 from pathlib import Path
@@ -22,8 +23,13 @@ SCOPES = [
 ]
 
 
+@functools.lru_cache(maxsize=None)
 def get_sheets_client(credentials_path: str = DEFAULT_CREDENTIALS_PATH) -> gspread.Client:
-    """Authenticate with service account and return a gspread client."""
+    """Authenticate with service account and return a gspread client.
+
+    The client is created once per credentials file and reused; gspread refreshes
+    its token as needed.
+    """
     creds = Credentials.from_service_account_file(credentials_path, scopes=SCOPES)
     return gspread.authorize(creds)
 
@@ -164,18 +170,21 @@ def load_initialization_from_sheet(sheet_id: str, platform: str = "browser", tab
 RESULTS_HEADER = ["Test_Run", "Date", "Groupings", "Test_Name", "TestScript_Action", "CUA_Action", "Expected_Outcome", "CUA_Result", "Debug_Results", "CUA_Thinking", "Claude_Evaluating"]
 
 
+# Results worksheets by (sheet_id, tab_name), so repeated writes in one run skip the lookups
+_RESULTS_WORKSHEETS: dict[tuple[str, str], gspread.Worksheet] = {}
+
+
 def _get_next_test_run(worksheet) -> int:
     """Determine the next Test_Run number by reading existing data."""
-    all_values = worksheet.get_all_values()
-    if len(all_values) <= 1:
-        return 1
+    # Only the Test_Run column is needed, not the whole results history
+    run_values = worksheet.col_values(1)
     max_run = 0
-    for row in all_values[1:]:
+    for value in run_values[1:]:
         try:
-            val = int(row[0])
+            val = int(value)
             if val > max_run:
                 max_run = val
-        except (ValueError, IndexError):
+        except ValueError:
             continue
     return max_run + 1
 
@@ -197,23 +206,22 @@ def write_results_to_sheet(
 
     Returns the test_run number used.
     """
-    client = get_sheets_client()
-    sheet = client.open_by_key(sheet_id)
-
-    try:
-        worksheet = sheet.worksheet(tab_name)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = sheet.add_worksheet(title=tab_name, rows=1000, cols=len(RESULTS_HEADER))
-        worksheet.append_row(RESULTS_HEADER)
+    worksheet = _RESULTS_WORKSHEETS.get((sheet_id, tab_name))
+    if worksheet is None:
+        sheet = get_sheets_client().open_by_key(sheet_id)
+        try:
+            worksheet = sheet.worksheet(tab_name)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = sheet.add_worksheet(title=tab_name, rows=1000, cols=len(RESULTS_HEADER))
+            worksheet.append_row(RESULTS_HEADER)
+        _RESULTS_WORKSHEETS[(sheet_id, tab_name)] = worksheet
 
     if test_run is None:
         test_run = _get_next_test_run(worksheet)
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    rows_to_write = []
-
-    for r in results:
-        rows_to_write.append([
+    rows_to_write = [
+        [
             test_run,
             timestamp,
             r.get("grouping", ""),
@@ -225,8 +233,11 @@ def write_results_to_sheet(
             r.get("debug_results", ""),
             r.get("cua_thinking", ""),
             r.get("claude_evaluating", ""),
-        ])
+        ]
+        for r in results
+    ]
 
+    # All rows go out in a single append request
     if rows_to_write:
         worksheet.append_rows(rows_to_write, value_input_option="USER_ENTERED")
 
@@ -236,7 +247,9 @@ def write_results_to_sheet(
 if __name__ == "__main__":
     """Standalone test: read the sheet and print parsed tests."""
     import argparse
-    import json
+    import sys
+
+    import json_io
 
     parser = argparse.ArgumentParser(description="Test Google Sheets loader")
     parser.add_argument("sheet_id", nargs="?", default="12zDcMDPiGV-0UhbIFT50K7DgOwIRebg9u8eCV9umg4k")
@@ -255,7 +268,7 @@ if __name__ == "__main__":
             "test_count": len(tests),
             "tests": tests,
         }
-        print(json.dumps(output, indent=2))
+        sys.stdout.buffer.write(json_io.dumps(output, indent=True) + b"\n")
     else:
         print(f"Loading tests from sheet: {args.sheet_id} (platform: {args.platform})")
         print(f"\nFound {len(tests)} tests:\n")
@@ -3,33 +3,150 @@ CUA QA Test Runner
 Executes test scripts defined in YAML format using Claude's Computer Use API.
 """
 
-import functools
-import sys
-
-# Force unbuffered stdout so output appears in real-time when piped
-print = functools.partial(print, flush=True)
-
 import asyncio
+import copy
+import io
+import logging
+import logging.handlers
 import os
+import queue
+import re
 import sys
-import json
 import base64
 import time
+import fastjsonschema
 import yaml
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from dataclasses import dataclass, field
 from typing import Optional
-from jinja2 import Template
+from jinja2 import Environment
+from PIL import Image
 from dotenv import load_dotenv
 
+try:
+    # libyaml-backed parser; several times faster than the pure-Python SafeLoader
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    import h2  # noqa: F401 -- lets the SDK's HTTP client negotiate HTTP/2
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
 # Load .env file from project root
 load_dotenv(Path(__file__).parent / ".env")
 
-from computer_use_demo.loop import sampling_loop, APIProvider
+from computer_use_demo.loop import sampling_loop, APIProvider, PROVIDER_TO_DEFAULT_MODEL_NAME
 from computer_use_demo.tools import ToolResult
-from anthropic.types.beta import BetaMessage, BetaMessageParam
-from anthropic import APIResponse
+import json_io
+from debug_results import DebugResultsCollector
+from anthropic.types.beta import BetaMessageParam
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient, Timeout
+
+
+# QA instructions appended to the computer-use system prompt, ahead of any
+# initialization instructions. Identical for every step, so it caches well.
+_SYSTEM_PREFIX = (
+    "You are a QA testing agent. Execute actions precisely. "
+    "IMPORTANT: wait is NOT a valid action. triple_click is NOT a valid action. "
+    "To select all text in an input field, use the key action with cmd+a."
+)
+
+# Per-step prompt. Optional fields are pre-rendered with their leading newline,
+# or as "" when the step doesn't define them.
+_STEP_PROMPT_TEMPLATE = (
+    "Execute this test step:\n\n"
+    "ACTION: {action}{precondition}{expected}{postcondition}\n"
+    "\nFirst, take a screenshot to see the current state. Then perform the action.\n"
+    "After performing the action, take a screenshot and read the DEBUG OUTPUT section. "
+    "The DEBUG OUTPUT section has a dark header bar labeled 'DEBUG OUTPUT' and displays JSON log lines below it.\n\n"
+    "Respond with:\n"
+    "- DEBUG_RESULTS: Copy the exact text from the DEBUG OUTPUT section"
+)
+
+# Prompt for a shard of consecutive steps run in one sampling loop. Each step is
+# rendered with _SHARD_STEP_TEMPLATE and numbered by its position in the test.
+_SHARD_PROMPT_TEMPLATE = (
+    "Execute these test steps in order:\n\n"
+    "{steps}\n\n"
+    "For each step: write STEP <number> on its own line before you start it, take a screenshot "
+    "to see the current state, then perform the action. After performing the action, take a "
+    "screenshot and read the DEBUG OUTPUT section. "
+    "The DEBUG OUTPUT section has a dark header bar labeled 'DEBUG OUTPUT' and displays JSON log lines below it.\n\n"
+    "Finish each step, before starting the next one, with:\n"
+    "- STEP <number> DEBUG_RESULTS: Copy the exact text from the DEBUG OUTPUT section"
+)
+_SHARD_STEP_TEMPLATE = "STEP {number}\nACTION: {action}{precondition}{expected}{postcondition}"
+# A step announcement, and a step's debug results running up to the next announcement.
+# Both only count "STEP <n>" at the start of a line (allowing list/bold markup), so a
+# "step 3" inside the debug text doesn't end the results or move screenshots along.
+_STEP_MARKER_RE = re.compile(r"^[ \t*-]*STEP (\d+)\b", re.MULTILINE)
+_SHARD_RESULTS_RE = re.compile(
+    r"^[ \t*-]*STEP (\d+)\s+(?i:DEBUG[_ ]RESULTS):\**\s*(.*?)(?=^[ \t*-]*STEP \d+\b|\Z)",
+    re.MULTILINE | re.DOTALL,
+)
+
+# Prompt for judging a finished step's debug output against its expected outcome.
+# It needs no screenshots, so these requests can go through the Message Batches API.
+_VERIFY_PROMPT_TEMPLATE = (
+    "You are evaluating the result of a QA test step.\n\n"
+    "ACTION: {action}\n"
+    "EXPECTED OUTCOME: {expected}\n"
+    "ACTUAL DEBUG OUTPUT:\n{actual}\n\n"
+    "Decide whether the actual debug output satisfies the expected outcome. Judge the intent, "
+    "not the exact wording; sometimes an error message is the expected outcome. "
+    "Prioritize JSON lines with \"type\":\"result\".\n\n"
+    "Respond with:\n"
+    "VERIFICATION: PASS or FAIL\n"
+    "OBSERVATION: One or two sentences explaining the decision"
+)
+# Verdict and (optional) observation in a single pass over the response
+_VERIFICATION_RE = re.compile(
+    r"VERIFICATION:\**\s*(PASS|FAIL)\b.*?(?:OBSERVATION:\**\s*(.*))?$", re.IGNORECASE | re.DOTALL
+)
+
+# Shape of a YAML test script, checked on load so a typo fails before any API call.
+# Compiled once to plain Python by fastjsonschema.
+_validate_test_config = fastjsonschema.compile({
+    "type": "object",
+    "required": ["steps"],
+    "properties": {
+        "name": {"type": "string"},
+        "platform": {"type": "string"},
+        "grouping": {"type": "string"},
+        "parallel": {"type": "boolean"},
+        "shard_size": {"type": "integer", "minimum": 1},
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["action"],
+                "properties": {
+                    "action": {"type": "string"},
+                    "expected": {"type": "string"},
+                    "state_before": {"type": "string"},
+                    "state_after": {"type": "string"},
+                },
+            },
+        },
+    },
+})
+
+# Parsed YAML test scripts by absolute path, as (mtime_ns, size, config). An entry is
+# reused while the file's mtime and size are unchanged; least recently used goes first.
+_YAML_CACHE: OrderedDict[str, tuple[int, int, dict]] = OrderedDict()
+_YAML_CACHE_MAX = 100
+# With CUA_YAML_CACHE=1, parsed scripts are also kept on disk as <file>.cache.json
+# so a fresh process can skip YAML parsing while the YAML is unchanged
+_YAML_SIDECAR = os.getenv("CUA_YAML_CACHE") == "1"
+
+# Console output goes through this logger; see _start_console_logging()
+logger = logging.getLogger("cua_qa")
 
 
 # Pricing per million tokens (USD)
@@ -45,10 +162,38 @@ MODEL_PRICING = {
 }
 
 
-def calculate_cost(input_tokens: int, output_tokens: int, model: str) -> float:
-    """Calculate USD cost from token counts and model name."""
+def calculate_cost(input_tokens: int, output_tokens: int, model: str,
+                   cache_write_tokens: int = 0, cache_read_tokens: int = 0) -> float:
+    """Calculate USD cost from token counts and model name.
+
+    Prompt-cache writes are billed at 1.25x the input rate and cache reads at 0.1x.
+    """
     pricing = MODEL_PRICING.get(model, MODEL_PRICING["claude-opus-4-6"])
-    return (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
+    billed_input = input_tokens + cache_write_tokens * 1.25 + cache_read_tokens * 0.1
+    return (billed_input * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
+
+
+def _parse_verification(text: str) -> tuple[Optional[str], str]:
+    """Return ('pass' | 'fail' | None, observation) from a verification response."""
+    match = _VERIFICATION_RE.search(text)
+    if not match:
+        return None, text.strip()
+    return match.group(1).lower(), (match.group(2) or text).strip()
+
+
+def _write_screenshot(path, base64_image: str, image_format: str = "png"):
+    """Decode a base64 PNG screenshot and write it to disk. Runs in a worker thread.
+
+    With image_format "webp" the PNG is re-encoded as lossy WebP, which is several
+    times smaller for UI screenshots.
+    """
+    data = base64.b64decode(base64_image)
+    # A 1 MiB buffer turns the encoder's many small writes into a few large ones
+    with open(path, "wb", buffering=1 << 20) as f:
+        if image_format == "webp":
+            Image.open(io.BytesIO(data)).save(f, format="WEBP", quality=85, method=4)
+        else:
+            f.write(data)
 
 
 @dataclass
@@ -61,8 +206,11 @@ class StepResult:
     actual: str = ""  # Debug console output (Debug_Results)
     cua_comments: str = ""  # Full LLM response text (CUA_Comments)
     screenshot_paths: list[str] = field(default_factory=list)
+    screenshots_base64: list[str] = field(default_factory=list)  # As received from the tool, for embedded reports
+    screenshot_relpaths: list[str] = field(default_factory=list)  # Relative to reports_dir, for linked reports
+    screenshots_mime: str = "image/png"  # Media type of screenshots_base64
     error_message: Optional[str] = None
-    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+    timestamp: int = field(default_factory=time.time_ns)  # Wall-clock step start, ns since the epoch
     duration_seconds: float = 0.0
     state_before: str = ""
     state_after: str = ""
@@ -70,7 +218,19 @@ class StepResult:
     grouping: str = ""
     input_tokens: int = 0
     output_tokens: int = 0
+    cache_write_tokens: int = 0  # Prompt-cache writes, not included in input_tokens
+    cache_read_tokens: int = 0  # Prompt-cache reads, not included in input_tokens
     model: str = ""
+    evaluation: str = ""  # Why the step was judged pass/fail (Claude_Evaluating)
+
+    @property
+    def cost(self) -> float:
+        return calculate_cost(self.input_tokens, self.output_tokens, self.model,
+                              self.cache_write_tokens, self.cache_read_tokens)
+
+    @property
+    def timestamp_iso(self) -> str:
+        return datetime.fromtimestamp(self.timestamp / 1e9).isoformat(timespec="seconds")
 
 
 @dataclass
@@ -82,42 +242,199 @@ class TestResult:
     end_time: str = ""
     status: str = "running"  # 'pass', 'fail', 'error'
     steps: list[StepResult] = field(default_factory=list)
+    _status_counts: Optional[Counter] = field(default=None, init=False, repr=False, compare=False)
+
+    def _tally(self) -> Counter:
+        """Count step statuses in one pass; cached once the test has ended."""
+        if self._status_counts is not None:
+            return self._status_counts
+        counts = Counter(s.status for s in self.steps)
+        if self.end_time:
+            self._status_counts = counts
+        return counts
 
     @property
     def passed_count(self) -> int:
-        return sum(1 for s in self.steps if s.status == 'pass')
+        return self._tally()['pass']
 
     @property
     def failed_count(self) -> int:
-        return sum(1 for s in self.steps if s.status == 'fail')
+        return self._tally()['fail']
 
     @property
     def error_count(self) -> int:
-        return sum(1 for s in self.steps if s.status == 'error')
+        return self._tally()['error']
+
+    def apply_verdicts(self):
+        """Recompute the overall status after steps were judged pass/fail."""
+        self._status_counts = None  # step statuses changed after the test ended
+        if self.error_count:
+            self.status = 'error'
+        elif self.failed_count:
+            self.status = 'fail'
+        else:
+            self.status = 'pass'
 
 
 class TestRunner:
     """Runs CUA QA tests from YAML test scripts."""
 
-    def __init__(self, api_key: str, model: str = "claude-opus-4-6", provider: str = "anthropic", initialization_instructions: str = ""):
+    # Screenshot base64 decode + write happens off the event loop. One pool is shared by
+    # every runner, so concurrent tests don't multiply the writer threads.
+    _io_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="screenshot-io")
+
+    def __init__(self, api_key: str, model: str = "claude-opus-4-6", provider: str = "anthropic", initialization_instructions: str = "",
+                 history_window: Optional[int] = None, screenshot_format: str = "webp", save_screenshots: str = "all",
+                 embed_images: bool = False, batch: bool = False):
         self.api_key = api_key
         self.model = model
         self.provider_name = provider
         self.provider = APIProvider.ANTHROPIC  # used only for anthropic path
-        self.screenshots_dir = Path("screenshots")
-        self.reports_dir = Path("reports")
+        # Resolved once so per-screenshot paths are plain string formatting
+        self.screenshots_dir = Path("screenshots").resolve()
+        self.reports_dir = Path("reports").resolve()
         self.screenshots_dir.mkdir(exist_ok=True)
         self.reports_dir.mkdir(exist_ok=True)
-        self.current_step_screenshots: list[str] = []
-        self.current_step_id: str = ""
+        # Screenshots arrive as PNG; "webp" re-encodes them on write, "png" keeps them as is
+        self.screenshot_format = screenshot_format
+        # A "%" in the directory would otherwise be read as a format directive
+        self._screenshot_fmt = os.path.join(str(self.screenshots_dir).replace('%', '%%'), f"%s_%d.{screenshot_format}")
+        # Which steps get their screenshots written to disk: "all", "failures" or "none"
+        self.save_screenshots = save_screenshots
+        # Raw screenshot data is a few MB per step, so steps only hold on to it while
+        # something may still use it: an embedded report inlines it, and the "failures"
+        # policy writes it once a step errors or, when a batch judge will run (batch),
+        # is judged to fail
+        self.embed_images = embed_images
+        self.batch = batch
+        self.keep_screenshot_data = embed_images or save_screenshots == "failures"
+        # Steps queue their screenshots and move on; one background task feeds the shared
+        # I/O pool and run_test waits for the queue to drain before returning.
+        self._io_queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+        self._io_task: Optional[asyncio.Task] = None
         self.initialization_instructions: str = initialization_instructions
         # Conversation context carried across steps within a test
         self.messages: list[BetaMessageParam] = []
+        # Number of most recent steps kept verbatim in self.messages, besides the
+        # first step, which is always kept (None keeps all)
+        self.history_window = history_window
+        # Actions of the steps still in self.messages, and of those trimmed away
+        self._history_actions: list[str] = []
+        self._trimmed_actions: list[str] = []
+        # Index of the trimmed-steps summary in self.messages, once there is one
+        self._summary_at: Optional[int] = None
+        # Upper bound on steps in flight for tests that set `parallel: true`
+        self.max_concurrency = int(os.getenv("CUA_MAX_CONCURRENCY", "5"))
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        # Seconds a streamed response may go without a single event before the step is abandoned
+        self.stall_timeout = float(os.getenv("CUA_STALL_TIMEOUT", "30"))
+        # Wall-clock anchor; per-step times are derived from the monotonic clock
+        self._base_wall_ns = time.time_ns()
+        self._base_mono_ns = time.monotonic_ns()
+        # One client, and so one keep-alive (HTTP/2 when available) connection
+        # pool, shared by every Anthropic call this runner makes
+        self.anthropic: Optional[AsyncAnthropic] = None
+        if provider == "anthropic":
+            self.anthropic = AsyncAnthropic(
+                api_key=api_key,
+                http_client=DefaultAsyncHttpxClient(http2=_HTTP2),
+                # Responses can take minutes to generate; connecting should not
+                timeout=Timeout(600.0, connect=30.0),
+                max_retries=2,
+            )
 
-    def load_test(self, test_path: str) -> dict:
-        """Load a test script from YAML file."""
-        with open(test_path, 'r') as f:
-            return yaml.safe_load(f)
+    async def aclose(self):
+        """Close the runner's HTTP connection pool and stop its screenshot writer task."""
+        if self.anthropic is not None:
+            await self.anthropic.close()
+        await self.flush_screenshots()
+        if self._io_task is not None:
+            self._io_task.cancel()
+
+    def _queue_screenshot(self, path: str, base64_image: str):
+        """Hand a screenshot to the background writer; flush_screenshots() waits for it."""
+        if self._io_task is None:
+            self._io_task = asyncio.create_task(self._drain_screenshots())
+        self._io_queue.put_nowait((path, base64_image))
+
+    async def _drain_screenshots(self):
+        """Pass queued screenshots to the I/O pool for as long as the runner lives."""
+        loop = asyncio.get_running_loop()
+        while True:
+            path, base64_image = await self._io_queue.get()
+            write = loop.run_in_executor(self._io_pool, _write_screenshot, path, base64_image,
+                                         self.screenshot_format)
+            write.add_done_callback(self._screenshot_written)
+
+    def _screenshot_written(self, write: asyncio.Future):
+        """Report a failed write and mark the queue entry done."""
+        if not write.cancelled() and write.exception() is not None:
+            logger.warning(f"    Screenshot write failed: {write.exception()}")
+        self._io_queue.task_done()
+
+    async def flush_screenshots(self):
+        """Wait until every queued screenshot is on disk."""
+        await self._io_queue.join()
+
+    def _now_ns(self) -> int:
+        """Current wall-clock time in ns since the epoch, derived from the monotonic clock."""
+        return self._base_wall_ns + time.monotonic_ns() - self._base_mono_ns
+
+    def _now(self) -> datetime:
+        """Current wall-clock time as a datetime."""
+        return datetime.fromtimestamp(self._now_ns() / 1e9)
+
+    def load_test(self, test_path: str, fresh: bool = False) -> dict:
+        """Load a test script from YAML file.
+
+        Parsed scripts are cached until the file changes. Callers get a deep copy,
+        so mutating the returned dict never touches the cache. Pass fresh=True to
+        always re-parse (e.g. when editing a file faster than its mtime ticks).
+        """
+        key = os.path.abspath(test_path)
+        st = os.stat(key)
+        hit = None if fresh else _YAML_CACHE.get(key)
+        if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+            _YAML_CACHE.move_to_end(key)
+            return copy.deepcopy(hit[2])
+
+        sidecar = key + ".cache.json"
+        test_config = None
+        if _YAML_SIDECAR and not fresh:
+            try:
+                if os.stat(sidecar).st_mtime_ns >= st.st_mtime_ns:
+                    test_config = json_io.read_json(sidecar)
+            except (OSError, ValueError):
+                test_config = None  # missing or unreadable; parse the YAML instead
+
+        if test_config is None:
+            # One read up front: the loader then parses the bytes in a single pass
+            # instead of pulling the file through Python-level reads
+            test_config = yaml.load(Path(key).read_bytes(), Loader=_YamlLoader)
+            try:
+                _validate_test_config(test_config)
+            except fastjsonschema.JsonSchemaValueException as e:
+                raise ValueError(f"Invalid test script {test_path}: {e.message}") from e
+            if _YAML_SIDECAR:
+                # Only cache configs JSON reproduces exactly: YAML allows non-string keys
+                # and dates, which would come back from the sidecar changed
+                try:
+                    data = json_io.dumps(test_config)
+                    faithful = json_io.loads(data) == test_config
+                except TypeError:
+                    faithful = False
+                if faithful:
+                    try:
+                        with open(sidecar, 'wb') as f:
+                            f.write(data)
+                    except OSError:
+                        pass  # read-only test directory; the in-memory cache still applies
+
+        _YAML_CACHE[key] = (st.st_mtime_ns, st.st_size, test_config)
+        _YAML_CACHE.move_to_end(key)
+        if len(_YAML_CACHE) > _YAML_CACHE_MAX:
+            _YAML_CACHE.popitem(last=False)
+        return copy.deepcopy(test_config)
 
     async def run_test(self, test_input, verbose: bool = True, keep_context: bool = False) -> TestResult:
         """Run a complete test from a YAML file path or a pre-built test dict."""
@@ -134,228 +451,577 @@ class TestRunner:
         result = TestResult(
             name=test_name,
             platform=platform,
-            start_time=datetime.now().isoformat()
+            start_time=self._now().isoformat()
         )
 
         # Reset conversation context unless keeping it from previous test
         if not keep_context:
             self.messages = []
+            self._history_actions = []
+            self._trimmed_actions = []
+            self._summary_at = None
 
         if verbose:
-            print(f"\n{'='*60}")
-            print(f"Running Test: {test_name}")
-            print(f"Platform: {platform}")
-            print(f"Steps: {len(steps)}")
-            print(f"{'='*60}\n")
-
-        for i, step in enumerate(steps, 1):
-            action = step.get('action', '')
-            expected = step.get('expected', '')
-            state_before = step.get('state_before', '')
-            state_after = step.get('state_after', '')
-
+            logger.info(f"\n{'='*60}")
+            logger.info(f"Running Test: {test_name}")
+            logger.info(f"Platform: {platform}")
+            logger.info(f"Steps: {len(steps)}")
+            logger.info(f"{'='*60}\n")
+
+        if test_config.get('parallel', False):
+            # Independent steps: each runs in its own conversation, bounded by self._sem.
+            # They still share the one screen, so their input can interleave.
             if verbose:
-                print(f"\n[Step {i}/{len(steps)}]")
-                print(f"  Action: {action}")
-                if state_before:
-                    print(f"  Precondition: {state_before}")
-                print(f"  Expected: {expected}")
-                if state_after:
-                    print(f"  Postcondition: {state_after}")
-
-            step_result = await self.run_step(i, action, expected, verbose,
-                                              state_before=state_before, state_after=state_after)
+                logger.info(f"Running steps in parallel (up to {self.max_concurrency} at a time, sharing one screen)")
+            outcomes = await asyncio.gather(
+                *(self._run_step_sem(i, len(steps), step, verbose) for i, step in enumerate(steps, 1)),
+                return_exceptions=True,
+            )
+            for i, (step, outcome) in enumerate(zip(steps, outcomes), 1):
+                if not isinstance(outcome, StepResult):
+                    outcome = StepResult(
+                        step_number=i,
+                        action=step.get('action', ''),
+                        expected=step.get('expected', ''),
+                        status="error",
+                        error_message=str(outcome),
+                    )
+                result.steps.append(outcome)
+        elif test_config.get('shard_size'):
+            # Consecutive steps share one sampling loop, shard_size steps at a time
+            shard_size = int(test_config['shard_size'])
+            for start in range(0, len(steps), shard_size):
+                shard = steps[start:start + shard_size]
+                result.steps.extend(await self.run_shard(start + 1, len(steps), shard, verbose))
+                self._trim_history()
+        else:
+            for i, step in enumerate(steps, 1):
+                result.steps.append(await self._run_test_step(i, len(steps), step, verbose))
+                self._trim_history()
+
+        await self.flush_screenshots()
+
+        for step_result in result.steps:
             step_result.test_name = test_name
             step_result.grouping = grouping
-            result.steps.append(step_result)
-
-            if verbose:
-                step_cost = calculate_cost(step_result.input_tokens, step_result.output_tokens, step_result.model)
-                print(f"  Result: {step_result.status.upper()}")
-                print(f"  Duration: {step_result.duration_seconds:.1f}s")
-                print(f"  Tokens: {step_result.input_tokens:,} in / {step_result.output_tokens:,} out (${step_cost:.4f})")
-                if step_result.actual:
-                    print(f"  Debug Results: {step_result.actual[:200]}")
-                if step_result.error_message:
-                    print(f"  Error: {step_result.error_message}")
 
-        result.end_time = datetime.now().isoformat()
+        result.end_time = self._now().isoformat()
         result.status = 'error' if result.error_count > 0 else 'done'
 
         if verbose:
             total_in = sum(s.input_tokens for s in result.steps)
             total_out = sum(s.output_tokens for s in result.steps)
-            test_cost = sum(calculate_cost(s.input_tokens, s.output_tokens, s.model) for s in result.steps)
-            print(f"\n{'='*60}")
-            print(f"Test Complete: {result.status.upper()}")
-            print(f"  Steps: {len(result.steps)}")
-            print(f"  Errors: {result.error_count}/{len(result.steps)}")
-            print(f"  Tokens: {total_in:,} in / {total_out:,} out")
-            print(f"  Cost: ${test_cost:.4f}")
-            print(f"{'='*60}\n")
+            test_cost = sum(s.cost for s in result.steps)
+            logger.info(f"\n{'='*60}")
+            logger.info(f"Test Complete: {result.status.upper()}")
+            logger.info(f"  Steps: {len(result.steps)}")
+            logger.info(f"  Errors: {result.error_count}/{len(result.steps)}")
+            logger.info(f"  Tokens: {total_in:,} in / {total_out:,} out")
+            logger.info(f"  Cost: ${test_cost:.4f}")
+            logger.info(f"{'='*60}\n")
 
         return result
 
-    async def run_step(self, step_num: int, action: str, expected: str, verbose: bool = True,
-                       state_before: str = "", state_after: str = "") -> StepResult:
-        """Run a single test step, carrying conversation context from prior steps."""
-        self.current_step_id = f"step_{step_num}_{datetime.now().strftime('%H%M%S')}"
-        self.current_step_screenshots = []
+    async def run_test_batch(self, test_input, verbose: bool = True) -> TestResult:
+        """Run a test, then judge its steps with one Message Batches request.
+
+        The steps drive the screen and run live as usual; only the text-only
+        pass/fail judgment is batched, at half the price and outside the
+        standard rate limits. Verdicts arrive once the batch has ended.
+        """
+        batch, self.batch = self.batch, True
+        try:
+            result = await self.run_test(test_input, verbose=verbose)
+        finally:
+            self.batch = batch
+        try:
+            await self.verify_steps_batch(result.steps, verbose=verbose)
+        except Exception as e:
+            logger.warning(f"Batch verification failed, keeping results without verdicts: {e}")
+        else:
+            if self.save_screenshots == "failures":
+                for step in result.steps:
+                    if step.status == "fail":
+                        self._save_screenshots(step)
+                await self.flush_screenshots()
+            result.apply_verdicts()
+        for step in result.steps:
+            self._release_screenshot_data(step)
+        return result
+
+    async def verify_steps_batch(self, steps: list[StepResult], verbose: bool = True,
+                                 poll_interval: float = 5.0, max_poll_interval: float = 60.0):
+        """Judge completed steps through the Anthropic Message Batches API.
+
+        Each judged step gets status 'pass' or 'fail' and the judge's reasoning in
+        evaluation. Steps that errored or have no expected outcome are left as is.
+        The batch is polled with exponential backoff until processing has ended.
+        """
+        to_judge = [s for s in steps if s.status == "done" and s.expected]
+        if not to_judge:
+            return
+
+        # Judging always goes through Anthropic, even when Gemini ran the steps
+        if self.provider_name == "anthropic":
+            api_key, model = self.api_key, self.model
+        else:
+            api_key = os.getenv("ANTHROPIC_API_KEY")
+            model = PROVIDER_TO_DEFAULT_MODEL_NAME[APIProvider.ANTHROPIC]
+        if not api_key:
+            raise ValueError("Batch verification requires ANTHROPIC_API_KEY")
+
+        client = self.anthropic or AsyncAnthropic(api_key=api_key)
+        batch = await client.messages.batches.create(requests=[
+            {
+                "custom_id": f"step_{n}",
+                "params": {
+                    "model": model,
+                    "max_tokens": 1024,
+                    "messages": [{
+                        "role": "user",
+                        "content": _VERIFY_PROMPT_TEMPLATE.format(
+                            action=step.action, expected=step.expected, actual=step.actual or "(empty)",
+                        ),
+                    }],
+                },
+            }
+            for n, step in enumerate(to_judge)
+        ])
+        if verbose:
+            logger.info(f"Submitted {len(to_judge)} step(s) for batch verification: {batch.id}")
+
+        delay = poll_interval
+        while batch.processing_status != "ended":
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_poll_interval)
+            batch = await client.messages.batches.retrieve(batch.id)
+
+        input_tokens = output_tokens = 0
+        async for entry in await client.messages.batches.results(batch.id):
+            step = to_judge[int(entry.custom_id.removeprefix("step_"))]
+            if entry.result.type != "succeeded":
+                step.evaluation = f"Batch verification {entry.result.type}"
+                continue
+            message = entry.result.message
+            input_tokens += message.usage.input_tokens
+            output_tokens += message.usage.output_tokens
+            verdict, step.evaluation = _parse_verification(
+                "".join(block.text for block in message.content if block.type == "text")
+            )
+            if verdict:
+                step.status = verdict
+
+        if verbose:
+            # Batch requests are billed at half the standard rate
+            cost = calculate_cost(input_tokens, output_tokens, model) / 2
+            logger.info(f"Batch verification: {input_tokens:,} in / {output_tokens:,} out (${cost:.4f})")
+
+    async def _run_test_step(self, i: int, total: int, step: dict, verbose: bool,
+                             messages: Optional[list[BetaMessageParam]] = None) -> StepResult:
+        """Run step i of a test config, logging its header and outcome."""
+        action = step.get('action', '')
+        expected = step.get('expected', '')
+        state_before = step.get('state_before', '')
+        state_after = step.get('state_after', '')
+
+        if verbose:
+            logger.info(f"\n[Step {i}/{total}]")
+            logger.info(f"  Action: {action}")
+            if state_before:
+                logger.info(f"  Precondition: {state_before}")
+            logger.info(f"  Expected: {expected}")
+            if state_after:
+                logger.info(f"  Postcondition: {state_after}")
+
+        step_result = await self.run_step(i, action, expected, verbose,
+                                          state_before=state_before, state_after=state_after,
+                                          messages=messages)
+
+        if verbose:
+            step_cost = step_result.cost
+            logger.info(f"  Result: {step_result.status.upper()}")
+            logger.info(f"  Duration: {step_result.duration_seconds:.1f}s")
+            logger.info(f"  Tokens: {step_result.input_tokens:,} in / {step_result.output_tokens:,} out (${step_cost:.4f})")
+            if step_result.actual:
+                logger.info(f"  Debug Results: {step_result.actual[:200]}")
+            if step_result.error_message:
+                logger.error(f"  Error: {step_result.error_message}")
+
+        return step_result
+
+    async def _run_step_sem(self, i: int, total: int, step: dict, verbose: bool) -> StepResult:
+        """Run a step in a fresh conversation once a concurrency slot is free."""
+        async with self._sem:
+            return await self._run_test_step(i, total, step, verbose, messages=[])
+
+    async def run_shard(self, first_num: int, total: int, steps: list[dict], verbose: bool = True) -> list[StepResult]:
+        """Run consecutive steps as one prompt in the runner's conversation.
+
+        The model keeps its bearings between steps instead of re-orienting for
+        each one. It reports STEP <n> DEBUG_RESULTS per step; screenshots go to
+        whichever step was last announced. Token usage and duration are split
+        evenly across the shard.
+        """
+        numbers = range(first_num, first_num + len(steps))
+        step_ns = self._now_ns()
+        shard_id = f"shard_{first_num}_{step_ns}"
+        screenshots: dict[int, list[str]] = {n: [] for n in numbers}
+        screenshots_b64: dict[int, list[str]] = {n: [] for n in numbers}
         screenshot_counter = 0
+        current = first_num
         step_start = time.monotonic()
 
-        # Build the prompt for this step
-        prompt_parts = [f"Execute this test step:\n\nACTION: {action}"]
+        if verbose:
+            logger.info(f"\n[Steps {first_num}-{numbers[-1]}/{total}]")
+            for n, step in zip(numbers, steps):
+                logger.info(f"  {n}. {step.get('action', '')}")
+
+        prompt = _SHARD_PROMPT_TEMPLATE.format(steps="\n\n".join(
+            _SHARD_STEP_TEMPLATE.format(
+                number=n,
+                action=step.get('action', ''),
+                precondition=f"\nPRECONDITION: {step['state_before']}" if step.get('state_before') else "",
+                expected=f"\nEXPECTED OUTCOME: {step['expected']}" if step.get('expected') else "",
+                postcondition=f"\nPOSTCONDITION: {step['state_after']}" if step.get('state_after') else "",
+            )
+            for n, step in zip(numbers, steps)
+        ))
+        self._history_actions.append("; ".join(step.get('action', '') for step in steps))
+        self.messages.append({"role": "user", "content": prompt})
+
+        output_buf = io.StringIO()
+
+        def output_callback(content_block):
+            nonlocal current
+            if hasattr(content_block, 'type') and content_block.type == "text":
+                text = content_block.text
+            elif isinstance(content_block, dict) and content_block.get("type") == "text":
+                text = content_block.get("text", "")
+            else:
+                return
+            # Newline-separated, so a block starting with "STEP <n>" starts a line
+            if output_buf.tell():
+                output_buf.write("\n")
+            output_buf.write(text)
+            for match in _STEP_MARKER_RE.finditer(text):
+                if int(match.group(1)) in screenshots:
+                    current = int(match.group(1))
+            if verbose:
+                logger.info(f"    Claude: {text[:100]}..." if len(text) > 100 else f"    Claude: {text}")
+
+        def tool_output_callback(result: ToolResult, tool_use_id: str):
+            nonlocal screenshot_counter
+            if result.base64_image:
+                screenshot_counter += 1
+                if self.save_screenshots == "all":
+                    screenshot_path = self._screenshot_fmt % (shard_id, screenshot_counter)
+                    self._queue_screenshot(screenshot_path, result.base64_image)
+                    screenshots[current].append(screenshot_path)
+                if self.keep_screenshot_data:
+                    screenshots_b64[current].append(result.base64_image)
+            if result.error:
+                logger.warning(f"    Tool error: {result.error}")
 
-        if state_before:
-            prompt_parts.append(f"PRECONDITION: {state_before}")
+        error_message = None
+        token_usage = {"input_tokens": 0, "output_tokens": 0, "model": self.model}
+        try:
+            token_usage = await self._sample(self.messages, output_callback, tool_output_callback)
+        except Exception as e:
+            error_message = str(e)
+
+        full_output = output_buf.getvalue()
+        debug_results = {int(m.group(1)): m.group(2).strip() for m in _SHARD_RESULTS_RE.finditer(full_output)}
+        per_step_duration = (time.monotonic() - step_start) / len(steps)
+        in_share, in_rest = divmod(token_usage["input_tokens"], len(steps))
+        out_share, out_rest = divmod(token_usage["output_tokens"], len(steps))
+
+        step_results = []
+        for k, (n, step) in enumerate(zip(numbers, steps)):
+            reported = n in debug_results and error_message is None
+            step_result = StepResult(
+                step_number=n,
+                action=step.get('action', ''),
+                expected=step.get('expected', ''),
+                status="done" if reported else "error",
+                actual=debug_results.get(n, ""),
+                cua_comments=full_output,
+                screenshot_paths=screenshots[n],
+                screenshots_base64=screenshots_b64[n],
+                error_message=None if reported else error_message or "No DEBUG_RESULTS reported for this step",
+                timestamp=step_ns,
+                duration_seconds=per_step_duration,
+                state_before=step.get('state_before', ''),
+                state_after=step.get('state_after', ''),
+                # Remainders go to the first step so shard totals stay exact
+                input_tokens=in_share + (in_rest if k == 0 else 0),
+                output_tokens=out_share + (out_rest if k == 0 else 0),
+                # Cache traffic is booked on the shard's first step
+                cache_write_tokens=token_usage.get("cache_creation_input_tokens", 0) if k == 0 else 0,
+                cache_read_tokens=token_usage.get("cache_read_input_tokens", 0) if k == 0 else 0,
+                model=token_usage["model"],
+            )
+            if not reported:
+                if self.save_screenshots == "failures":
+                    self._save_screenshots(step_result)
+            elif not self.batch:
+                self._release_screenshot_data(step_result)
+            step_results.append(step_result)
+            if verbose:
+                logger.info(f"  Step {n}: {step_result.status.upper()}")
+                if step_result.actual:
+                    logger.info(f"    Debug Results: {step_result.actual[:200]}")
+                if step_result.error_message:
+                    logger.error(f"    Error: {step_result.error_message}")
 
-        if expected:
-            prompt_parts.append(f"EXPECTED OUTCOME: {expected}")
+        return step_results
 
-        if state_after:
-            prompt_parts.append(f"POSTCONDITION: {state_after}")
+    async def run_step(self, step_num: int, action: str, expected: str, verbose: bool = True,
+                       state_before: str = "", state_after: str = "",
+                       messages: Optional[list[BetaMessageParam]] = None) -> StepResult:
+        """Run a single test step.
+
+        By default the step continues the runner's conversation (self.messages).
+        Pass a separate messages list to run it in its own conversation instead.
+        """
+        step_ns = self._now_ns()
+        step_id = f"step_{step_num}_{step_ns}"
+        step_screenshots: list[str] = []
+        step_screenshots_b64: list[str] = []
+        screenshot_counter = 0
+        step_start = time.monotonic()
 
-        prompt_parts.append(
-            "\nFirst, take a screenshot to see the current state. Then perform the action.\n"
-            "After performing the action, take a screenshot and read the DEBUG OUTPUT section. "
-            "The DEBUG OUTPUT section has a dark header bar labeled 'DEBUG OUTPUT' and displays JSON log lines below it.\n\n"
-            "Respond with:\n"
-            "- DEBUG_RESULTS: Copy the exact text from the DEBUG OUTPUT section"
+        # Build the prompt for this step
+        prompt = _STEP_PROMPT_TEMPLATE.format(
+            action=action,
+            precondition=f"\nPRECONDITION: {state_before}" if state_before else "",
+            expected=f"\nEXPECTED OUTCOME: {expected}" if expected else "",
+            postcondition=f"\nPOSTCONDITION: {state_after}" if state_after else "",
         )
 
-        prompt = "\n".join(prompt_parts)
-
         # Append to existing conversation context (not a fresh list)
-        self.messages.append({"role": "user", "content": prompt})
+        if messages is None:
+            messages = self.messages
+            self._history_actions.append(action)
+        messages.append({"role": "user", "content": prompt})
 
-        collected_output = []
+        # DEBUG_RESULTS are split off from the rest of the output as it arrives
+        collector = DebugResultsCollector()
+
+        def collect_text(text: str):
+            if collector.add(text) and verbose:
+                logger.info("    Debug results received")
+            if verbose:
+                logger.info(f"    Claude: {text[:100]}..." if len(text) > 100 else f"    Claude: {text}")
 
         def output_callback(content_block):
             if hasattr(content_block, 'type') and content_block.type == "text":
-                text = content_block.text
-                collected_output.append(text)
-                if verbose:
-                    print(f"    Claude: {text[:100]}..." if len(text) > 100 else f"    Claude: {text}")
+                collect_text(content_block.text)
             elif isinstance(content_block, dict) and content_block.get("type") == "text":
-                text = content_block.get("text", "")
-                collected_output.append(text)
-                if verbose:
-                    print(f"    Claude: {text[:100]}..." if len(text) > 100 else f"    Claude: {text}")
+                collect_text(content_block.get("text", ""))
 
         def tool_output_callback(result: ToolResult, tool_use_id: str):
             nonlocal screenshot_counter
             if result.base64_image:
                 screenshot_counter += 1
-                screenshot_path = self.screenshots_dir / f"{self.current_step_id}_{screenshot_counter}.png"
-                with open(screenshot_path, "wb") as f:
-                    f.write(base64.b64decode(result.base64_image))
-                self.current_step_screenshots.append(str(screenshot_path))
-                if verbose:
-                    print(f"    Screenshot saved: {screenshot_path}")
+                if self.keep_screenshot_data:
+                    step_screenshots_b64.append(result.base64_image)
+                if self.save_screenshots == "all":
+                    screenshot_path = self._screenshot_fmt % (step_id, screenshot_counter)
+                    self._queue_screenshot(screenshot_path, result.base64_image)
+                    step_screenshots.append(screenshot_path)
+                    if verbose:
+                        logger.info(f"    Screenshot saved: {screenshot_path}")
             if result.output and verbose:
-                print(f"    Tool output: {result.output[:80]}..." if len(result.output) > 80 else f"    Tool output: {result.output}")
+                logger.info(f"    Tool output: {result.output[:80]}..." if len(result.output) > 80 else f"    Tool output: {result.output}")
             if result.error:
-                print(f"    Tool error: {result.error}")
-
-        def api_response_callback(response: APIResponse[BetaMessage]):
-            pass
+                logger.warning(f"    Tool error: {result.error}")
 
         try:
             # Pass the accumulated messages — sampling_loop mutates in place
-            system_suffix_parts = [
-                "You are a QA testing agent. Execute actions precisely. "
-                "IMPORTANT: wait is NOT a valid action. triple_click is NOT a valid action. "
-                "To select all text in an input field, use the key action with cmd+a.",
-            ]
-            if self.initialization_instructions:
-                system_suffix_parts.append(self.initialization_instructions)
-
-            if self.provider_name == "gemini":
-                from computer_use_demo.gemini_loop import sampling_loop_gemini
-                _, token_usage = await sampling_loop_gemini(
-                    model=self.model,
-                    system_prompt_suffix="\n".join(system_suffix_parts),
-                    messages=self.messages,
-                    output_callback=output_callback,
-                    tool_output_callback=tool_output_callback,
-                    api_key=self.api_key,
-                    max_turns=15,
-                )
-            else:
-                _, token_usage = await sampling_loop(
-                    model=self.model,
-                    provider=self.provider,
-                    system_prompt_suffix="\n".join(system_suffix_parts),
-                    messages=self.messages,
-                    output_callback=output_callback,
-                    tool_output_callback=tool_output_callback,
-                    api_response_callback=api_response_callback,
-                    api_key=self.api_key,
-                    only_n_most_recent_images=3,
-                    max_tokens=4096,
-                )
-
+            token_usage = await self._sample(messages, output_callback, tool_output_callback)
             step_duration = time.monotonic() - step_start
 
-            full_output = " ".join(collected_output)
-
-            # Extract DEBUG_RESULTS from CUA output
-            if "DEBUG_RESULTS:" in full_output:
-                dr_start = full_output.find("DEBUG_RESULTS:") + len("DEBUG_RESULTS:")
-                debug_results = full_output[dr_start:].strip()
-            else:
-                debug_results = full_output[:500] if full_output else ""
+            full_output = collector.full_output
+            debug_results = collector.debug_results
 
-            return StepResult(
+            step_result = StepResult(
                 step_number=step_num,
                 action=action,
                 expected=expected,
                 status="done",
                 actual=debug_results,
                 cua_comments=full_output,
-                screenshot_paths=list(self.current_step_screenshots),
+                screenshot_paths=step_screenshots,
+                screenshots_base64=step_screenshots_b64,
+                timestamp=step_ns,
                 duration_seconds=step_duration,
                 state_before=state_before,
                 state_after=state_after,
                 input_tokens=token_usage["input_tokens"],
                 output_tokens=token_usage["output_tokens"],
+                cache_write_tokens=token_usage.get("cache_creation_input_tokens", 0),
+                cache_read_tokens=token_usage.get("cache_read_input_tokens", 0),
                 model=token_usage["model"],
             )
+            # Without a batch judge to come, a done step is final and its data unneeded
+            if not self.batch:
+                self._release_screenshot_data(step_result)
+            return step_result
 
         except Exception as e:
             step_duration = time.monotonic() - step_start
-            return StepResult(
+            step_result = StepResult(
                 step_number=step_num,
                 action=action,
                 expected=expected,
                 status="error",
                 error_message=str(e),
-                screenshot_paths=list(self.current_step_screenshots),
+                screenshot_paths=step_screenshots,
+                screenshots_base64=step_screenshots_b64,
+                timestamp=step_ns,
                 duration_seconds=step_duration,
                 state_before=state_before,
                 state_after=state_after,
             )
+            if self.save_screenshots == "failures":
+                self._save_screenshots(step_result)
+            return step_result
 
-    def generate_report(self, result: TestResult) -> str:
-        """Generate an HTML report for the test results."""
-        template = Template(HTML_REPORT_TEMPLATE)
+    def _release_screenshot_data(self, step: StepResult):
+        """Drop a step's raw screenshot data unless an embedded report still needs it."""
+        if not self.embed_images:
+            step.screenshots_base64 = []
 
-        report_filename = f"report_{result.name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-        report_path = self.reports_dir / report_filename
+    def _save_screenshots(self, step: StepResult):
+        """Queue a step's screenshots for writing after the fact, for the deferred save policies."""
+        step_id = f"step_{step.step_number}_{self._now_ns()}"
+        step.screenshot_paths = [
+            self._screenshot_fmt % (step_id, n) for n in range(1, len(step.screenshots_base64) + 1)
+        ]
+        for path, b64 in zip(step.screenshot_paths, step.screenshots_base64):
+            self._queue_screenshot(path, b64)
+        self._release_screenshot_data(step)
+
+    async def _sample(self, messages: list[BetaMessageParam], output_callback, tool_output_callback) -> dict:
+        """Run the provider's sampling loop over messages and return its token usage."""
+        system_suffix = (f"{_SYSTEM_PREFIX}\n{self.initialization_instructions}"
+                         if self.initialization_instructions else _SYSTEM_PREFIX)
+
+        if self.provider_name == "gemini":
+            from computer_use_demo.gemini_loop import sampling_loop_gemini
+            _, token_usage = await sampling_loop_gemini(
+                model=self.model,
+                system_prompt_suffix=system_suffix,
+                messages=messages,
+                output_callback=output_callback,
+                tool_output_callback=tool_output_callback,
+                api_key=self.api_key,
+                max_turns=15,
+            )
+        else:
+            # Dead-man timer: responses are streamed, and one that goes quiet for
+            # stall_timeout seconds is abandoned. Tools running between responses
+            # don't count as silence: a response may ask for several, so the
+            # timer stays off from its message_stop until the next request is sent.
+            last_activity = time.monotonic()
+            awaiting_tools = False
+
+            def stream_callback(event):
+                nonlocal last_activity, awaiting_tools
+                last_activity = time.monotonic()
+                if event.type == "message_stop":
+                    awaiting_tools = True
+                elif event.type == "request_start":
+                    awaiting_tools = False
+
+            def watched_tool_output_callback(result: ToolResult, tool_use_id: str):
+                nonlocal last_activity
+                last_activity = time.monotonic()
+                tool_output_callback(result, tool_use_id)
+
+            task = asyncio.ensure_future(sampling_loop(
+                model=self.model,
+                provider=self.provider,
+                system_prompt_suffix=system_suffix,
+                messages=messages,
+                output_callback=output_callback,
+                tool_output_callback=watched_tool_output_callback,
+                api_response_callback=lambda response: None,
+                api_key=self.api_key,
+                only_n_most_recent_images=3,
+                max_tokens=4096,
+                client=self.anthropic,
+                stream_callback=stream_callback,
+            ))
+            try:
+                while not task.done():
+                    await asyncio.wait({task}, timeout=min(5.0, self.stall_timeout))
+                    if (not task.done() and not awaiting_tools
+                            and time.monotonic() - last_activity > self.stall_timeout):
+                        raise TimeoutError(f"No response from the model for {self.stall_timeout:g}s")
+                _, token_usage = task.result()
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+        return token_usage
+
+    def _trim_history(self):
+        """Collapse the steps between the first one and the last history_window.
+
+        Every step begins with a plain-text user prompt and owns the turns up to the
+        next one, so cutting at a prompt never separates a tool_use from its
+        tool_result. The first step sets the scene and stays verbatim, which also
+        keeps the front of the prompt stable for caching; the trimmed steps after
+        it are replaced by a single summary message.
+        """
+        if self.history_window is None:
+            return
+
+        step_starts = [
+            i for i, message in enumerate(self.messages)
+            if message["role"] == "user" and isinstance(message["content"], str) and i != self._summary_at
+        ]
+        later_starts = step_starts[1:]
+        excess = len(later_starts) - self.history_window
+        if excess <= 0:
+            return
+
+        first_step = self.messages[:self._summary_at if self._summary_at is not None else later_starts[0]]
+        self._trimmed_actions.extend(self._history_actions[1:1 + excess])
+        del self._history_actions[1:1 + excess]
+        summary = "Previous test steps (details trimmed): " + "; ".join(
+            f"{n}) {action}" for n, action in enumerate(self._trimmed_actions, 2)
+        )
+        kept = self.messages[later_starts[excess]:] if excess < len(later_starts) else []
+        self.messages = first_step + [{"role": "user", "content": summary}] + kept
+        self._summary_at = len(first_step)
 
-        # Convert screenshots to base64 for embedding in HTML
-        for step in result.steps:
-            step.screenshots_base64 = []
-            for spath in step.screenshot_paths:
-                if Path(spath).exists():
-                    with open(spath, 'rb') as f:
-                        step.screenshots_base64.append(base64.b64encode(f.read()).decode())
+    def generate_report(self, result: TestResult, embed_images: bool = False) -> str:
+        """Generate an HTML report for the test results.
+
+        Screenshots are linked by path relative to the report unless embed_images
+        is set, in which case they are inlined as base64 for a self-contained file.
+        """
+        if not embed_images:
+            for step in result.steps:
+                step.screenshot_relpaths = [os.path.relpath(p, self.reports_dir) for p in step.screenshot_paths]
+        else:
+            for step in result.steps:
+                # Normally the tool's own base64 is kept; results built elsewhere may only have files
+                if step.screenshot_paths and not step.screenshots_base64:
+                    # A screenshot whose write failed is left out rather than failing the report
+                    existing = [Path(p) for p in step.screenshot_paths if Path(p).exists()]
+                    step.screenshots_base64 = [base64.b64encode(p.read_bytes()).decode() for p in existing]
+                    if existing:
+                        step.screenshots_mime = f"image/{existing[0].suffix.lstrip('.').lower()}"
 
-        html_content = template.render(result=result)
+        report_filename = f"report_{result.name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+        report_path = self.reports_dir / report_filename
 
-        with open(report_path, 'w') as f:
-            f.write(html_content)
+        # Rendered chunk by chunk into a 1 MiB buffer; the full HTML is never held in memory
+        with open(report_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            _REPORT_TEMPLATE.stream(result=result, embed_images=embed_images).dump(f)
 
         return str(report_path)
 
@@ -434,7 +1100,7 @@ HTML_REPORT_TEMPLATE = """<!DOCTYPE html>
                 <div class="step-number">{{ step.step_number }}</div>
                 <div style="flex: 1;">
                     <strong>{{ step.action }}</strong>
-                    <span class="step-duration">({{ "%.1f"|format(step.duration_seconds) }}s)</span>
+                    <span class="step-duration">({{ "%.1f"|format(step.duration_seconds) }}s, started <time datetime="{{ step.timestamp_iso }}">{{ step.timestamp_iso[11:] }}</time>)</span>
                 </div>
                 <div class="step-status {{ step.status }}">{{ step.status }}</div>
             </div>
@@ -447,14 +1113,21 @@ HTML_REPORT_TEMPLATE = """<!DOCTYPE html>
                     <label>Actual Result</label>
                     <p>{{ step.actual or step.error_message or 'N/A' }}</p>
                 </div>
-                {% if step.screenshots_base64 %}
+                {% if step.evaluation %}
+                <div class="step-detail">
+                    <label>Evaluation</label>
+                    <p>{{ step.evaluation }}</p>
+                </div>
+                {% endif %}
+                {% set screenshot_srcs = step.screenshots_base64 if embed_images else step.screenshot_relpaths %}
+                {% if screenshot_srcs %}
                 <div class="screenshots">
                     <label style="font-weight: 600; color: #666; font-size: 12px; text-transform: uppercase; display: block; margin-bottom: 8px;">Screenshots</label>
                     <div class="screenshots-grid">
-                        {% for screenshot_b64 in step.screenshots_base64 %}
+                        {% for screenshot_src in screenshot_srcs %}
                         <div class="screenshot-item">
                             <div class="screenshot-label">{% if loop.first %}Before{% elif loop.last and not loop.first %}After{% else %}During ({{ loop.index }}){% endif %}</div>
-                            <img src="data:image/png;base64,{{ screenshot_b64 }}" alt="Step {{ step.step_number }} screenshot {{ loop.index }}">
+                            <img src="{% if embed_images %}data:{{ step.screenshots_mime }};base64,{{ screenshot_src|safe }}{% else %}{{ screenshot_src }}{% endif %}" alt="Step {{ step.step_number }} screenshot {{ loop.index }}">
                         </div>
                         {% endfor %}
                     </div>
@@ -472,38 +1145,133 @@ HTML_REPORT_TEMPLATE = """<!DOCTYPE html>
 </html>
 """
 
+# Compiled once at import. Autoescape keeps debug output and CUA text from breaking the
+# HTML; base64 payloads are marked |safe, as their alphabet needs no escaping and they
+# are the bulk of the output.
+_REPORT_ENV = Environment(autoescape=True, auto_reload=False, enable_async=False)
+_REPORT_TEMPLATE = _REPORT_ENV.from_string(HTML_REPORT_TEMPLATE)
+
+
+def _start_console_logging() -> logging.handlers.QueueListener:
+    """Send cua_qa log records through a queue to one stdout writer thread.
+
+    Steps only enqueue records, so they never block on or contend for stdout.
+    Records are printed verbatim and flushed one by one, like the old print()
+    calls, so output still appears in real time when piped.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+def _sheet_row(step: StepResult) -> dict:
+    """Map a step result onto a Results tab row (see sheets_loader.write_results_to_sheet)."""
+    return {
+        "grouping": step.grouping,
+        "test_name": step.test_name,
+        "testscript_action": step.action,
+        "expected": step.expected,
+        "cua_result": step.status.upper(),
+        "debug_results": step.actual or "",
+        "cua_thinking": step.cua_comments or step.error_message or "",
+        "claude_evaluating": step.evaluation,
+    }
+
+
+async def _sheet_writer(sheet_id: str, row_queue: asyncio.Queue, batch_size: int = 5,
+                        max_batch_size: int = 200) -> tuple[Optional[int], int]:
+    """Append result rows from the queue to the Google Sheet until a None arrives.
+
+    Whatever is queued (up to batch_size rows) is written in one call from a
+    worker thread. The batch size starts small so the first results appear
+    quickly, then doubles after each write up to max_batch_size. A failed write
+    is logged and its rows are retried with the next batch. Returns the Test_Run
+    number shared by every batch and the number of rows written.
+    """
+    from sheets_loader import write_results_to_sheet
+
+    test_run = None
+    written = 0
+    pending: list[dict] = []  # Rows not written yet, including those of failed writes
+    while True:
+        item = await row_queue.get()
+        while item is not None:
+            pending.append(item)
+            if len(pending) >= batch_size or row_queue.empty():
+                break
+            item = row_queue.get_nowait()
+
+        if pending:
+            try:
+                test_run = await asyncio.to_thread(write_results_to_sheet, sheet_id, pending, test_run=test_run)
+            except Exception as e:
+                logger.warning(f"Writing {len(pending)} result row(s) to the sheet failed: {e}")
+            else:
+                written += len(pending)
+                pending = []
+                batch_size = min(batch_size * 2, max_batch_size)
+
+        if item is None:
+            if pending:
+                logger.error(f"{len(pending)} result row(s) could not be written to the sheet")
+            return test_run, written
+
 
 async def main():
     """Main entry point for the test runner."""
     import argparse
 
     parser = argparse.ArgumentParser(description="CUA QA Test Runner")
-    parser.add_argument("test_file", nargs="?", help="YAML test file path")
+    parser.add_argument("test_files", nargs="*", metavar="test_file", help="YAML test file(s) or directories of them")
     parser.add_argument("--sheet", metavar="SHEET_ID", help="Google Sheet ID to load tests from")
     parser.add_argument("--test", metavar="TEST_NAME", action="append", help="Run test(s) by name — can be repeated (requires --sheet)")
     parser.add_argument("--group", metavar="GROUP_NAME", help="Run all tests in a group (requires --sheet)")
     parser.add_argument("--report", action="store_true", help="Generate HTML report")
+    parser.add_argument("--embed-images", action="store_true", help="Inline screenshots in the HTML report instead of linking to them")
+    parser.add_argument("--save-screenshots", choices=["all", "failures", "none"], default="all",
+                        help="Which steps get screenshots written to disk (default: all)")
+    parser.add_argument("--png", action="store_true", help="Keep screenshots as PNG instead of re-encoding them to WebP")
     parser.add_argument("--dry-run", action="store_true", help="List tests without executing CUA")
     parser.add_argument("--platform", choices=["browser", "ios", "android"], default="browser", help="Target platform (default: browser)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Judge every step's result against its expected outcome in one Message Batches request (half price)")
+    parser.add_argument("--concurrency", type=int, default=1, metavar="N",
+                        help="Run up to N tests at once, each in its own conversation; they share one screen (default: 1, ignored with --sequential)")
+    parser.add_argument("--history-window", type=int, default=0, metavar="N",
+                        help="Keep only the first and the last N steps verbatim in the conversation; older ones are summarized (default: 0, keeps all)")
     parser.add_argument("--sequential", action="store_true", help="Share CUA conversation context across tests (for dependent test sequences)")
     parser.add_argument("--url", metavar="URL", help="Navigate to this URL before running tests")
     parser.add_argument("--provider", choices=["anthropic", "gemini"], default="anthropic", help="AI provider (default: anthropic)")
     args = parser.parse_args()
+    history_window = args.history_window if args.history_window > 0 else None
+    screenshot_format = "png" if args.png else "webp"
 
-    if not args.sheet and not args.test_file:
+    if not args.sheet and not args.test_files:
         parser.print_help()
         sys.exit(1)
 
+    # Verdicts always come from Claude, whichever provider drives the screen; fail
+    # before the run rather than after it
+    if args.batch and not os.getenv("ANTHROPIC_API_KEY"):
+        logger.error("Error: --batch requires the ANTHROPIC_API_KEY environment variable")
+        sys.exit(1)
+
     # Sheets mode
     if args.sheet:
-        from sheets_loader import load_tests_from_sheet, load_initialization_from_sheet, write_results_to_sheet
+        from sheets_loader import load_tests_from_sheet, load_initialization_from_sheet
 
-        print(f"Loading tests from Google Sheet: {args.sheet} (platform: {args.platform})")
+        logger.info(f"Loading tests from Google Sheet: {args.sheet} (platform: {args.platform})")
         init_instructions = load_initialization_from_sheet(args.sheet, platform=args.platform)
         if init_instructions:
-            print(f"Initialization instructions loaded for {args.platform}")
+            logger.info(f"Initialization instructions loaded for {args.platform}")
         all_tests = load_tests_from_sheet(args.sheet, platform=args.platform)
-        print(f"Found {len(all_tests)} tests")
+        logger.info(f"Found {len(all_tests)} tests")
 
         # Filter by --test or --group
         if args.test:
@@ -511,147 +1279,240 @@ async def main():
             tests = [t for t in all_tests if t["name"] in test_names]
             # Preserve the order from the sheet
             if not tests:
-                print(f"Error: No tests found matching: {', '.join(args.test)}")
-                print("Available tests:")
+                logger.error(f"Error: No tests found matching: {', '.join(args.test)}")
+                logger.info("Available tests:")
                 for t in all_tests:
-                    print(f"  [{t['grouping']}] {t['name']}")
+                    logger.info(f"  [{t['grouping']}] {t['name']}")
                 sys.exit(1)
         elif args.group:
             tests = [t for t in all_tests if t["grouping"] == args.group]
             if not tests:
-                print(f"Error: No tests found in group '{args.group}'")
-                print("Available groups:")
+                logger.error(f"Error: No tests found in group '{args.group}'")
+                logger.info("Available groups:")
                 groups = sorted(set(t["grouping"] for t in all_tests))
                 for g in groups:
                     count = sum(1 for t in all_tests if t["grouping"] == g)
-                    print(f"  {g} ({count} tests)")
+                    logger.info(f"  {g} ({count} tests)")
                 sys.exit(1)
         else:
             tests = all_tests
 
         # Dry run — just list tests
         if args.dry_run:
-            print(f"\nDry run — {len(tests)} tests would be executed (platform: {args.platform}):\n")
+            logger.info(f"\nDry run — {len(tests)} tests would be executed (platform: {args.platform}):\n")
             for i, t in enumerate(tests, 1):
                 step = t["steps"][0]
-                print(f"  {i}. [{t['grouping']}] {t['name']}")
-                print(f"     Platform: {t['platform']}")
-                print(f"     Action: {step['action']}")
-                print(f"     Expected: {step['expected']}")
+                logger.info(f"  {i}. [{t['grouping']}] {t['name']}")
+                logger.info(f"     Platform: {t['platform']}")
+                logger.info(f"     Action: {step['action']}")
+                logger.info(f"     Expected: {step['expected']}")
                 if step.get("state_before"):
-                    print(f"     Precondition: {step['state_before']}")
+                    logger.info(f"     Precondition: {step['state_before']}")
                 if step.get("state_after"):
-                    print(f"     Postcondition: {step['state_after']}")
-                print()
+                    logger.info(f"     Postcondition: {step['state_after']}")
+                logger.info("")
             sys.exit(0)
 
         # Run tests — select API key and default model based on provider
         if args.provider == "gemini":
             api_key = os.getenv("GEMINI_API_KEY")
             if not api_key:
-                print("Error: GEMINI_API_KEY environment variable not set")
+                logger.error("Error: GEMINI_API_KEY environment variable not set")
                 sys.exit(1)
             from computer_use_demo.gemini_loop import GEMINI_MODEL
             default_model = GEMINI_MODEL
         else:
             api_key = os.getenv("ANTHROPIC_API_KEY")
             if not api_key:
-                print("Error: ANTHROPIC_API_KEY environment variable not set")
+                logger.error("Error: ANTHROPIC_API_KEY environment variable not set")
                 sys.exit(1)
             default_model = "claude-opus-4-6"
 
-        print(f"Provider: {args.provider} | Model: {default_model}")
-        runner = TestRunner(api_key, model=default_model, provider=args.provider, initialization_instructions=init_instructions)
-
-        # Navigate to URL before first test (browser only)
-        if args.url and args.platform == "browser":
-            print(f"\nNavigating to: {args.url}")
-            nav_result = await runner.run_step(
-                0, f"Open a new tab in Google Chrome (Cmd+T) and navigate to {args.url}. Wait for the page to fully load.",
-                "Page is loaded and visible", verbose=True
-            )
-            if nav_result.status == "error":
-                print(f"Error navigating to URL: {nav_result.error_message}")
-                sys.exit(1)
-            print(f"Navigation: {nav_result.status.upper()}\n")
-        elif args.url and args.platform != "browser":
-            print(f"\nSkipping URL navigation (not supported on {args.platform} platform)")
-
-        all_results = []
-        sheet_results = []
-
-        for i, test_config in enumerate(tests):
-            keep_context = args.sequential and i > 0
-            result = await runner.run_test(test_config, keep_context=keep_context)
-            all_results.append(result)
+        logger.info(f"Provider: {args.provider} | Model: {default_model}")
+        runner = TestRunner(api_key, model=default_model, provider=args.provider, initialization_instructions=init_instructions,
+                            history_window=history_window, screenshot_format=screenshot_format,
+                            save_screenshots=args.save_screenshots, embed_images=args.embed_images,
+                            batch=args.batch)
 
-            # Collect results for writing back to sheet
-            for step in result.steps:
-                sheet_results.append({
-                    "grouping": step.grouping,
-                    "test_name": step.test_name,
-                    "action": step.action,
-                    "expected": step.expected,
-                    "cua_comments": step.cua_comments or step.error_message or "",
-                    "debug_results": step.actual or "",
-                })
-
-            if args.report:
-                report_path = runner.generate_report(result)
-                print(f"Report generated: {report_path}")
-
-        # Print token usage and cost summary
-        grand_in = sum(s.input_tokens for r in all_results for s in r.steps)
-        grand_out = sum(s.output_tokens for r in all_results for s in r.steps)
-        grand_cost = sum(calculate_cost(s.input_tokens, s.output_tokens, s.model) for r in all_results for s in r.steps)
-        model_used = all_results[0].steps[0].model if all_results and all_results[0].steps else "unknown"
-        print(f"\n{'='*60}")
-        print(f"Cost Summary ({model_used})")
-        print(f"  Input:  {grand_in:,} tokens")
-        print(f"  Output: {grand_out:,} tokens")
-        print(f"  Total:  {grand_in + grand_out:,} tokens")
-        print(f"  Cost:   ${grand_cost:.4f}")
-        print(f"{'='*60}")
-
-        # Write results back to Google Sheet
-        if sheet_results:
-            rows_written = write_results_to_sheet(args.sheet, sheet_results)
-            print(f"\nWrote {rows_written} result(s) to Google Sheet Results tab")
-
-        # Exit with appropriate code (only errors are failures)
-        any_errors = any(r.status == "error" for r in all_results)
-        sys.exit(1 if any_errors else 0)
+        try:
+            # Navigate to URL before first test (browser only)
+            if args.url and args.platform == "browser":
+                logger.info(f"\nNavigating to: {args.url}")
+                nav_result = await runner.run_step(
+                    0, f"Open a new tab in Google Chrome (Cmd+T) and navigate to {args.url}. Wait for the page to fully load.",
+                    "Page is loaded and visible", verbose=True
+                )
+                if nav_result.status == "error":
+                    logger.error(f"Error navigating to URL: {nav_result.error_message}")
+                    sys.exit(1)
+                logger.info(f"Navigation: {nav_result.status.upper()}\n")
+            elif args.url and args.platform != "browser":
+                logger.info(f"\nSkipping URL navigation (not supported on {args.platform} platform)")
+
+            all_results = []
+            # Dependent sequences must run in order
+            concurrency = 1 if args.sequential else max(1, args.concurrency)
+
+            # Results are streamed to the sheet as each test finishes, so a crash
+            # mid-run keeps everything written so far
+            sheet_queue: asyncio.Queue = asyncio.Queue()
+            writer_task = asyncio.create_task(_sheet_writer(args.sheet, sheet_queue))
+
+            def record(result: TestResult):
+                all_results.append(result)
+                # With --batch, rows wait for the verdicts
+                if not args.batch:
+                    for step in result.steps:
+                        sheet_queue.put_nowait(_sheet_row(step))
+
+            try:
+                if concurrency > 1:
+                    # Independent tests run side by side, each with its own runner (and
+                    # conversation); results are recorded in sheet order as they complete
+                    sem = asyncio.Semaphore(concurrency)
+
+                    async def bounded_run(index: int, test_config: dict):
+                        async with sem:
+                            test_runner = TestRunner(api_key, model=default_model, provider=args.provider,
+                                                     initialization_instructions=init_instructions,
+                                                     history_window=history_window,
+                                                     screenshot_format=screenshot_format,
+                                                     save_screenshots=args.save_screenshots,
+                                                     embed_images=args.embed_images, batch=args.batch)
+                            try:
+                                return index, await test_runner.run_test(test_config)
+                            finally:
+                                await test_runner.aclose()
+
+                    finished: dict[int, TestResult] = {}
+                    for next_done in asyncio.as_completed([bounded_run(i, t) for i, t in enumerate(tests)]):
+                        index, result = await next_done
+                        finished[index] = result
+                        while len(all_results) in finished:
+                            record(finished.pop(len(all_results)))
+                else:
+                    for i, test_config in enumerate(tests):
+                        keep_context = args.sequential and i > 0
+                        record(await runner.run_test(test_config, keep_context=keep_context))
+
+                if args.batch and all_results:
+                    # Every step of every test is judged in a single batch
+                    try:
+                        await runner.verify_steps_batch([s for r in all_results for s in r.steps])
+                    except Exception as e:
+                        logger.warning(f"Batch verification failed, writing results without verdicts: {e}")
+                    else:
+                        for result in all_results:
+                            result.apply_verdicts()
+                        if args.save_screenshots == "failures":
+                            for step in (s for r in all_results for s in r.steps if s.status == "fail"):
+                                runner._save_screenshots(step)
+                            await runner.flush_screenshots()
+                    for step in (s for r in all_results for s in r.steps):
+                        runner._release_screenshot_data(step)
+                    for step in (s for r in all_results for s in r.steps):
+                        sheet_queue.put_nowait(_sheet_row(step))
+            finally:
+                sheet_queue.put_nowait(None)
+                test_run, rows_written = await writer_task
+
+            # Reports are independent of each other, so render them concurrently
+            if args.report and all_results:
+                with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                    for report_path in executor.map(
+                        lambda r: runner.generate_report(r, embed_images=args.embed_images), all_results
+                    ):
+                        logger.info(f"Report generated: {report_path}")
+
+            # Print token usage and cost summary
+            grand_in = sum(s.input_tokens for r in all_results for s in r.steps)
+            grand_out = sum(s.output_tokens for r in all_results for s in r.steps)
+            grand_cost = sum(s.cost for r in all_results for s in r.steps)
+            model_used = all_results[0].steps[0].model if all_results and all_results[0].steps else "unknown"
+            logger.info(f"\n{'='*60}")
+            logger.info(f"Cost Summary ({model_used})")
+            logger.info(f"  Input:  {grand_in:,} tokens")
+            logger.info(f"  Output: {grand_out:,} tokens")
+            logger.info(f"  Total:  {grand_in + grand_out:,} tokens")
+            logger.info(f"  Cost:   ${grand_cost:.4f}")
+            logger.info(f"{'='*60}")
+
+            if rows_written:
+                logger.info(f"\nWrote {rows_written} result(s) to Google Sheet Results tab (Test_Run {test_run})")
+
+            # Exit non-zero if any test errored or, with --batch, was judged to fail
+            any_failures = any(r.status in ("error", "fail") for r in all_results)
+            sys.exit(1 if any_failures else 0)
+        finally:
+            await runner.aclose()
 
     # YAML mode (existing behavior)
     else:
         if args.provider == "gemini":
             api_key = os.getenv("GEMINI_API_KEY")
             if not api_key:
-                print("Error: GEMINI_API_KEY environment variable not set")
+                logger.error("Error: GEMINI_API_KEY environment variable not set")
                 sys.exit(1)
             from computer_use_demo.gemini_loop import GEMINI_MODEL
             default_model = GEMINI_MODEL
         else:
             api_key = os.getenv("ANTHROPIC_API_KEY")
             if not api_key:
-                print("Error: ANTHROPIC_API_KEY environment variable not set")
+                logger.error("Error: ANTHROPIC_API_KEY environment variable not set")
                 sys.exit(1)
             default_model = "claude-opus-4-6"
 
-        test_path = args.test_file
-        if not Path(test_path).exists():
-            print(f"Error: Test file not found: {test_path}")
+        test_paths = []
+        for arg in args.test_files:
+            path = Path(arg)
+            if path.is_dir():
+                test_paths.extend(sorted(path.glob("*.yaml")))
+            elif path.exists():
+                test_paths.append(path)
+            else:
+                logger.error(f"Error: Test file not found: {arg}")
+                sys.exit(1)
+        if not test_paths:
+            logger.error("Error: No YAML test files found")
             sys.exit(1)
 
-        runner = TestRunner(api_key, model=default_model, provider=args.provider)
-        result = await runner.run_test(test_path)
-
-        if args.report:
-            report_path = runner.generate_report(result)
-            print(f"\nReport generated: {report_path}")
-
-        sys.exit(0 if result.status == "pass" else 1)
+        # Each file gets its own runner (and conversation). All of them drive the same
+        # screen, so files run one at a time unless --concurrency says otherwise.
+        sem = asyncio.Semaphore(max(1, args.concurrency))
+
+        async def _run_one(test_path: Path):
+            async with sem:
+                runner = TestRunner(api_key, model=default_model, provider=args.provider,
+                                    history_window=history_window, screenshot_format=screenshot_format,
+                                    save_screenshots=args.save_screenshots, embed_images=args.embed_images)
+                try:
+                    if args.batch:
+                        result = await runner.run_test_batch(str(test_path))
+                    else:
+                        result = await runner.run_test(str(test_path))
+                finally:
+                    await runner.aclose()
+                if args.report:
+                    report_path = runner.generate_report(result, embed_images=args.embed_images)
+                    logger.info(f"\nReport generated: {report_path}")
+                return result
+
+        results = await asyncio.gather(*(_run_one(p) for p in test_paths), return_exceptions=True)
+
+        failed = False
+        for test_path, result in zip(test_paths, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error: {test_path}: {result}")
+                failed = True
+            elif result.status in ("error", "fail"):
+                failed = True
+
+        sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    listener = _start_console_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()